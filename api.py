@@ -7,11 +7,18 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import re
 import uvicorn
 from pathlib import Path
 
 from trigram_lm import (
     load_model,
+    compile_model,
+    load_compiled_model,
     load_tokenizer,
     tokenize,
     decode,
@@ -19,10 +26,11 @@ from trigram_lm import (
     TOKEN_BOS,
     TOKEN_EOT,
     MODEL_FILE,
+    MODEL_BIN_DIR,
     VOCAB_FILE,
     MERGES_FILE,
 )
-from train_bpe_tokenizer import TOKEN_EOS, TOKEN_EOP
+from train_bpe_tokenizer import TOKEN_EOS, TOKEN_EOP, build_merge_ranks
 
 app = FastAPI(
     title="Urdu Trigram Language Model API",
@@ -43,6 +51,18 @@ app.add_middleware(
 model = None
 vocab = None
 merge_rules = None
+merge_ranks = None  # pair -> rank lookup built once from merge_rules
+
+# Output cleanup: special tokens are filtered before decoding; stray special
+# characters are mapped with one str.translate and whitespace collapsed with one regex
+SPECIAL_TOKENS = frozenset({TOKEN_BOS, TOKEN_EOS, TOKEN_EOP, TOKEN_EOT})
+SPECIAL_TRANSLATE = str.maketrans({TOKEN_EOS: "۔", TOKEN_EOP: "\n\n", TOKEN_EOT: "", TOKEN_BOS: ""})
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Seeded requests are deterministic, so identical ones (e.g. client retries) are served from an LRU cache.
+# Keyed by (prefix, max_length, temperature, random_seed); requests without a seed are never cached.
+RESPONSE_CACHE_SIZE = 2048
+response_cache = OrderedDict()
 
 
 class GenerateRequest(BaseModel):
@@ -73,19 +93,26 @@ class GenerateResponse(BaseModel):
     stopped_at_eot: bool = Field(..., description="Whether generation stopped at EOT token")
 
 
+@functools.lru_cache(maxsize=4096)
+def _cached_tokenize(prefix: str) -> tuple:
+    """Tokenize a prefix once per unique string (the tokenizer is immutable once loaded)."""
+    return tuple(tokenize(prefix, vocab, merge_rules, merge_ranks))
+
+
 @app.on_event("startup")
 async def load_models():
     """Load model and tokenizer at application startup."""
-    global model, vocab, merge_rules
+    global model, vocab, merge_rules, merge_ranks
     
     print("Loading language model and tokenizer...")
     
     # Check if model files exist
     model_path = Path(MODEL_FILE)
+    bin_path = Path(MODEL_BIN_DIR)
     vocab_path = Path(VOCAB_FILE)
     merges_path = Path(MERGES_FILE)
     
-    if not model_path.exists():
+    if not model_path.exists() and not bin_path.exists():
         raise FileNotFoundError(
             f"Model file '{MODEL_FILE}' not found. Run trigram_lm.py to train the model first."
         )
@@ -95,14 +122,31 @@ async def load_models():
         )
     
     # Load model and tokenizer
-    model = load_model(MODEL_FILE)
+    # Prefer the memory-mapped tables (written by convert_model.py / trigram_lm.py)
+    if bin_path.exists():
+        model = load_compiled_model(MODEL_BIN_DIR)
+    else:
+        model = compile_model(load_model(MODEL_FILE))
     vocab, merge_rules = load_tokenizer(VOCAB_FILE, MERGES_FILE)
+    merge_ranks = build_merge_ranks(merge_rules)
+    _cached_tokenize.cache_clear()
     
-    print(f"✓ Model loaded: {len(model['unigram'])} unigrams, "
-          f"{len(model['bigram'])} bigrams, {len(model['trigram'])} trigrams")
+    print(f"✓ Model loaded: {model['num_unigrams']} unigrams, "
+          f"{model['num_bigrams']} bigrams, {model['num_trigrams']} trigrams")
+
+    # Generations run in a thread pool so sampling never blocks the event loop
+    app.state.pool = ThreadPoolExecutor()
     print("✓ API ready to serve requests")
 
 
+@app.on_event("shutdown")
+async def stop_pool():
+    """Shut down the generation thread pool."""
+    pool = getattr(app.state, "pool", None)
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
@@ -140,48 +184,59 @@ async def generate_text(request: GenerateRequest):
             detail="Model or tokenizer not loaded. Check server logs."
         )
     
+    cache_key = None
+    if request.random_seed is not None:
+        cache_key = (request.prefix, request.max_length, request.temperature, request.random_seed)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            response_cache.move_to_end(cache_key)
+            generated_text, num_tokens, stopped_at_eot = cached
+            return GenerateResponse(
+                generated_text=generated_text,
+                num_tokens=num_tokens,
+                stopped_at_eot=stopped_at_eot
+            )
+    
     try:
         # Tokenize the prefix
-        prefix_tokens = tokenize(request.prefix, vocab, merge_rules)
+        prefix_tokens = _cached_tokenize(request.prefix)
         
         # Use prefix as seed if provided, otherwise start from BOS
         if len(prefix_tokens) >= 2:
-            seed_tokens = prefix_tokens[-2:]  # Use last 2 tokens for trigram context
+            seed_tokens = list(prefix_tokens[-2:])  # Use last 2 tokens for trigram context
         elif len(prefix_tokens) == 1:
             seed_tokens = [TOKEN_BOS, prefix_tokens[0]]
         else:
             seed_tokens = None  # Will use [BOS, BOS]
         
-        # Generate tokens
-        generated_tokens = generate(
-            model=model,
-            seed_tokens=seed_tokens,
-            max_tokens=request.max_length,
-            temperature=request.temperature,
-            random_seed=request.random_seed,
+        # Generate in the thread pool; each request returns as soon as its own sequence is done
+        generated_tokens = await asyncio.get_running_loop().run_in_executor(
+            app.state.pool,
+            functools.partial(
+                generate,
+                model,
+                seed_tokens=seed_tokens,
+                max_tokens=request.max_length,
+                temperature=request.temperature,
+                random_seed=request.random_seed,
+            ),
         )
         
         # Remove special tokens (BOS, EOS, EOP, EOT) and decode
         # These special tokens show as boxes in the UI, so we filter them out
-        special_tokens = {TOKEN_BOS, TOKEN_EOS, TOKEN_EOP, TOKEN_EOT}
-        text_tokens = [t for t in generated_tokens if t not in special_tokens]
-        generated_text = decode(text_tokens)
+        text_tokens = [t for t in generated_tokens if t not in SPECIAL_TOKENS]
         
-        # Clean up any remaining special token characters that might have slipped through
-        # Replace them with appropriate punctuation or remove them
-        generated_text = generated_text.replace(TOKEN_EOS, "۔")  # Urdu full stop
-        generated_text = generated_text.replace(TOKEN_EOP, "\n\n")  # Paragraph break
-        generated_text = generated_text.replace(TOKEN_EOT, "")  # Remove EOT
-        generated_text = generated_text.replace(TOKEN_BOS, "")  # Remove BOS if any remain
-        
-        # Clean up multiple spaces and normalize whitespace
-        import re
-        generated_text = re.sub(r'\s+', ' ', generated_text)  # Multiple spaces to single space
-        generated_text = generated_text.strip()
+        # Map any special characters that slipped through, then collapse whitespace, in one pass each
+        generated_text = WHITESPACE_RE.sub(" ", decode(text_tokens).translate(SPECIAL_TRANSLATE)).strip()
         
         # Check if stopped at EOT
         stopped_at_eot = TOKEN_EOT in generated_tokens
         
+        if cache_key is not None:
+            response_cache[cache_key] = (generated_text, len(text_tokens), stopped_at_eot)
+            if len(response_cache) > RESPONSE_CACHE_SIZE:
+                response_cache.popitem(last=False)
+        
         return GenerateResponse(
             generated_text=generated_text,
             num_tokens=len(text_tokens),
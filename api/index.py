@@ -3,30 +3,38 @@ Vercel Serverless Function for FastAPI Backend
 This file handles all API routes for the Urdu Story Generator
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional
+from functools import lru_cache
 from pathlib import Path
+import json
 import sys
 import re
+import threading
 
 # Add parent directory to path to import modules
 sys.path.append(str(Path(__file__).parent.parent))
 
 from trigram_lm import (
     load_model,
+    compile_model,
+    load_compiled_model,
     load_tokenizer,
     tokenize,
     decode,
     generate,
+    generate_iter,
     TOKEN_BOS,
     TOKEN_EOT,
     MODEL_FILE,
+    MODEL_BIN_DIR,
     VOCAB_FILE,
     MERGES_FILE,
 )
-from train_bpe_tokenizer import TOKEN_EOS, TOKEN_EOP
+from train_bpe_tokenizer import TOKEN_EOS, TOKEN_EOP, build_merge_ranks
 
 app = FastAPI(
     title="Urdu Trigram Language Model API",
@@ -47,37 +55,71 @@ app.add_middleware(
 model = None
 vocab = None
 merge_rules = None
+merge_ranks = None  # pair -> rank lookup built once from merge_rules
+_model_lock = threading.Lock()
+
+# Output cleanup: special tokens are filtered before decoding; stray special
+# characters are mapped with one str.translate and whitespace collapsed with one regex
+SPECIAL_TOKENS = frozenset({TOKEN_BOS, TOKEN_EOS, TOKEN_EOP, TOKEN_EOT})
+SPECIAL_TRANSLATE = str.maketrans({TOKEN_EOS: "۔", TOKEN_EOP: "\n\n", TOKEN_EOT: "", TOKEN_BOS: ""})
+WHITESPACE_RE = re.compile(r"\s+")
 
 
 def get_model():
-    """Lazy load model - Vercel serverless functions need this pattern"""
-    global model, vocab, merge_rules
+    """
+    Lazy load model - Vercel serverless functions need this pattern.
+    Normally already done by the startup preload; the lock makes concurrent
+    cold requests wait for a single load instead of each loading the artifacts.
+    """
+    global model, vocab, merge_rules, merge_ranks
     
     if model is None or vocab is None:
-        print("Loading language model and tokenizer...")
-        
-        model_path = Path(MODEL_FILE)
-        vocab_path = Path(VOCAB_FILE)
-        merges_path = Path(MERGES_FILE)
-        
-        if not model_path.exists():
-            raise FileNotFoundError(
-                f"Model file '{MODEL_FILE}' not found."
-            )
-        if not vocab_path.exists() or not merges_path.exists():
-            raise FileNotFoundError(
-                f"Tokenizer files not found."
-            )
-        
-        model = load_model(MODEL_FILE)
-        vocab, merge_rules = load_tokenizer(VOCAB_FILE, MERGES_FILE)
-        
-        print(f"✓ Model loaded: {len(model['unigram'])} unigrams, "
-              f"{len(model['bigram'])} bigrams, {len(model['trigram'])} trigrams")
+        with _model_lock:
+            if model is None or vocab is None:
+                print("Loading language model and tokenizer...")
+                
+                model_path = Path(MODEL_FILE)
+                bin_path = Path(MODEL_BIN_DIR)
+                vocab_path = Path(VOCAB_FILE)
+                merges_path = Path(MERGES_FILE)
+                
+                if not model_path.exists() and not bin_path.exists():
+                    raise FileNotFoundError(
+                        f"Model file '{MODEL_FILE}' not found."
+                    )
+                if not vocab_path.exists() or not merges_path.exists():
+                    raise FileNotFoundError(
+                        f"Tokenizer files not found."
+                    )
+                
+                # Prefer the memory-mapped tables (written by convert_model.py / trigram_lm.py)
+                if bin_path.exists():
+                    loaded_model = load_compiled_model(MODEL_BIN_DIR)
+                else:
+                    loaded_model = compile_model(load_model(MODEL_FILE))
+                vocab, merge_rules = load_tokenizer(VOCAB_FILE, MERGES_FILE)
+                merge_ranks = build_merge_ranks(merge_rules)
+                _cached_tokenize.cache_clear()
+                _run_cached.cache_clear()
+                # Published last: other threads only skip the lock once everything is ready
+                model = loaded_model
+                
+                print(f"✓ Model loaded: {model['num_unigrams']} unigrams, "
+                      f"{model['num_bigrams']} bigrams, {model['num_trigrams']} trigrams")
     
     return model, vocab, merge_rules
 
 
+@app.on_event("startup")
+def preload_model():
+    """Load the model once per container at startup (needs Mangum lifespan="auto")."""
+    try:
+        get_model()
+    except Exception as e:
+        # Requests still retry the lazy load and report the error as a 503
+        print(f"Model preload failed: {e}")
+
+
 class GenerateRequest(BaseModel):
     """Request model for text generation."""
     prefix: str = Field(..., description="Input prefix text to continue from")
@@ -106,10 +148,19 @@ class GenerateResponse(BaseModel):
     stopped_at_eot: bool = Field(..., description="Whether generation stopped at EOT token")
 
 
-# Routes - handle both with and without /api prefix to cover different Vercel rewrite behaviors
-@app.get("/")
-@app.get("/api")
-@app.get("/api/")
+@lru_cache(maxsize=4096)
+def _cached_tokenize(prefix: str) -> tuple:
+    """Tokenize a prefix once per unique string (the tokenizer is immutable once loaded)."""
+    return tuple(tokenize(prefix, vocab, merge_rules, merge_ranks))
+
+
+# Routes are declared once on this router, which is mounted both with and without the /api prefix
+# (see the bottom of this file) to cover different Vercel rewrite behaviors
+router = APIRouter()
+
+
+@app.get("/api")  # The mounted router serves "/" and "/api/"; also answer the bare prefix without a redirect
+@router.get("/")
 async def root():
     """Health check endpoint."""
     return {
@@ -119,10 +170,9 @@ async def root():
     }
 
 
-@app.get("/health")
-@app.get("/api/health")
-async def health():
-    """Health check endpoint."""
+@router.get("/health")
+def health():
+    """Health check endpoint (sync: a cold model load runs in FastAPI's threadpool)."""
     try:
         model, vocab, _ = get_model()
         return {
@@ -138,19 +188,62 @@ async def health():
 
 
 # Handle OPTIONS for CORS preflight
-@app.options("/generate")
-@app.options("/api/generate")
+@router.options("/generate")
 async def options_generate():
     return {"status": "ok"}
 
-@app.post("/generate", response_model=GenerateResponse)
-@app.post("/api/generate", response_model=GenerateResponse)
-async def generate_text(request: GenerateRequest):
+
+def _seed_tokens(prefix: str) -> Optional[list]:
+    """Trigram context for a prefix: its last 2 tokens, BOS-padded; None starts from [BOS, BOS]."""
+    prefix_tokens = _cached_tokenize(prefix)
+    if len(prefix_tokens) >= 2:
+        return list(prefix_tokens[-2:])
+    elif len(prefix_tokens) == 1:
+        return [TOKEN_BOS, prefix_tokens[0]]
+    return None
+
+
+def _run(prefix: str, max_length: int, temperature: float, random_seed: Optional[int]) -> tuple:
+    """
+    Tokenize the prefix, generate and decode.
+    Returns (generated_text, num_tokens, stopped_at_eot).
+    """
+    model, _, _ = get_model()
+
+    # Generate tokens
+    generated_tokens = generate(
+        model=model,
+        seed_tokens=_seed_tokens(prefix),
+        max_tokens=max_length,
+        temperature=temperature,
+        random_seed=random_seed,
+    )
+
+    # Remove special tokens (BOS, EOS, EOP, EOT) and decode
+    text_tokens = [t for t in generated_tokens if t not in SPECIAL_TOKENS]
+
+    # Map any remaining special characters, then collapse whitespace, in one pass each
+    generated_text = WHITESPACE_RE.sub(" ", decode(text_tokens).translate(SPECIAL_TRANSLATE)).strip()
+
+    # Check if stopped at EOT
+    stopped_at_eot = TOKEN_EOT in generated_tokens
+
+    return generated_text, len(text_tokens), stopped_at_eot
+
+
+# Seeded requests are deterministic, so identical ones (e.g. client retries) are served from cache.
+# Requests without a seed bypass it and always sample fresh text.
+_run_cached = lru_cache(maxsize=2048)(_run)
+
+
+@router.post("/generate", response_model=GenerateResponse)
+def generate_text(request: GenerateRequest):
     """
     Generate text continuation from a given prefix.
+    Declared sync so FastAPI runs it in its threadpool instead of blocking the event loop.
     """
     try:
-        model, vocab, merge_rules = get_model()
+        get_model()
     except Exception as e:
         raise HTTPException(
             status_code=503,
@@ -158,47 +251,14 @@ async def generate_text(request: GenerateRequest):
         )
     
     try:
-        # Tokenize the prefix
-        prefix_tokens = tokenize(request.prefix, vocab, merge_rules)
-        
-        # Use prefix as seed if provided, otherwise start from BOS
-        if len(prefix_tokens) >= 2:
-            seed_tokens = prefix_tokens[-2:]
-        elif len(prefix_tokens) == 1:
-            seed_tokens = [TOKEN_BOS, prefix_tokens[0]]
-        else:
-            seed_tokens = None
-        
-        # Generate tokens
-        generated_tokens = generate(
-            model=model,
-            seed_tokens=seed_tokens,
-            max_tokens=request.max_length,
-            temperature=request.temperature,
-            random_seed=request.random_seed,
+        run = _run_cached if request.random_seed is not None else _run
+        generated_text, num_tokens, stopped_at_eot = run(
+            request.prefix, request.max_length, request.temperature, request.random_seed
         )
         
-        # Remove special tokens (BOS, EOS, EOP, EOT) and decode
-        special_tokens = {TOKEN_BOS, TOKEN_EOS, TOKEN_EOP, TOKEN_EOT}
-        text_tokens = [t for t in generated_tokens if t not in special_tokens]
-        generated_text = decode(text_tokens)
-        
-        # Clean up any remaining special token characters
-        generated_text = generated_text.replace(TOKEN_EOS, "۔")
-        generated_text = generated_text.replace(TOKEN_EOP, "\n\n")
-        generated_text = generated_text.replace(TOKEN_EOT, "")
-        generated_text = generated_text.replace(TOKEN_BOS, "")
-        
-        # Clean up multiple spaces and normalize whitespace
-        generated_text = re.sub(r'\s+', ' ', generated_text)
-        generated_text = generated_text.strip()
-        
-        # Check if stopped at EOT
-        stopped_at_eot = TOKEN_EOT in generated_tokens
-        
         return GenerateResponse(
             generated_text=generated_text,
-            num_tokens=len(text_tokens),
+            num_tokens=num_tokens,
             stopped_at_eot=stopped_at_eot
         )
     
@@ -209,12 +269,81 @@ async def generate_text(request: GenerateRequest):
         )
 
 
+def _sse(payload: dict) -> str:
+    """Format one server-sent event."""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _token_stream(request: GenerateRequest):
+    """
+    Yield an SSE event per decoded text token as it is sampled, then a final
+    event with num_tokens and stopped_at_eot. Special tokens are skipped and
+    whitespace is collapsed and stripped as in /generate, so the joined text
+    equals its generated_text.
+    """
+    model, _, _ = get_model()
+    num_tokens = 0
+    stopped_at_eot = False
+    started = False  # Leading whitespace is dropped
+    pending_space = False  # A space is only sent in front of the next text, so a trailing one never is
+
+    for token in generate_iter(
+        model=model,
+        seed_tokens=_seed_tokens(request.prefix),
+        max_tokens=request.max_length,
+        temperature=request.temperature,
+        random_seed=request.random_seed,
+    ):
+        if token == TOKEN_EOT:
+            stopped_at_eot = True
+        if token in SPECIAL_TOKENS:
+            continue
+        num_tokens += 1
+        text = WHITESPACE_RE.sub(" ", token)
+        core = text.strip(" ")
+        if not core:
+            pending_space = pending_space or bool(text)
+            continue
+        if started and (pending_space or text.startswith(" ")):
+            core = " " + core
+        started = True
+        pending_space = text.endswith(" ")
+        yield _sse({"text": core})
+
+    yield _sse({"done": True, "num_tokens": num_tokens, "stopped_at_eot": stopped_at_eot})
+
+
+@router.post("/generate/stream")
+def generate_text_stream(request: GenerateRequest):
+    """
+    Stream the continuation as server-sent events (text/event-stream) instead of
+    waiting for the whole generation. Events: {"text": ...} per token, then
+    {"done": true, "num_tokens": ..., "stopped_at_eot": ...}.
+    """
+    try:
+        get_model()
+    except Exception as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model loading error: {str(e)}"
+        )
+
+    # A sync generator: Starlette iterates it in its threadpool, off the event loop
+    return StreamingResponse(_token_stream(request), media_type="text/event-stream")
+
+
+# Mount every route at both /<route> and /api/<route> (include_router copies the routes, so this comes last)
+app.include_router(router)
+app.include_router(router, prefix="/api")
+
+
 # Vercel serverless function handler
 from mangum import Mangum
 
 # Export handler for Vercel - Mangum converts FastAPI ASGI app to AWS Lambda/Vercel format
 # Routes handle both /generate and /api/generate to cover different Vercel rewrite behaviors
-handler = Mangum(app, lifespan="off")
+# lifespan="auto" runs the startup preload once per warm container instead of on the first request
+handler = Mangum(app, lifespan="auto")
 
 # For local testing (not used in Vercel)
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+"""
+Convert the trained trigram model into memory-mapped binary tables.
+- Loads trigram_lm.pkl and compiles it into the sampling arrays (compile_model)
+- Writes raw .bin files + meta.json to trigram_lm_bin/ (save_compiled_model)
+- The API loads these with np.memmap, so cold starts skip pickle parsing and compilation
+Re-run whenever trigram_lm.pkl is retrained (trigram_lm.py also writes them after training).
+"""
+
+import time
+from pathlib import Path
+
+from trigram_lm import (
+    MODEL_FILE,
+    MODEL_BIN_DIR,
+    load_model,
+    compile_model,
+    save_compiled_model,
+    load_compiled_model,
+)
+
+
+def main():
+    print("=" * 60)
+    print("Model conversion: pickle -> memory-mapped tables")
+    print("=" * 60)
+
+    if not Path(MODEL_FILE).exists():
+        print(f"Error: Model file '{MODEL_FILE}' not found. Run trigram_lm.py first.")
+        return
+
+    start = time.perf_counter()
+    compiled = compile_model(load_model(MODEL_FILE))
+    pickle_time = time.perf_counter() - start
+    save_compiled_model(compiled, MODEL_BIN_DIR)
+    print(f"\nSaved compiled tables to {MODEL_BIN_DIR}/")
+
+    start = time.perf_counter()
+    load_compiled_model(MODEL_BIN_DIR)
+    mmap_time = time.perf_counter() - start
+
+    print(f"  Load from pickle + compile: {pickle_time * 1000:.1f} ms")
+    print(f"  Load from memory map:       {mmap_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
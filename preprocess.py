@@ -6,11 +6,15 @@ Preprocessing script for Urdu stories.
 - Outputs single consolidated txt file
 """
 
+import functools
 import os
 import re
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
+
 # Data paths
 DATA_FOLDER = "data"
 OUTPUT_FILE = "urdu_stories_preprocessed.txt"
@@ -21,15 +25,58 @@ TOKEN_EOS = "\uE001"  # End of Sentence
 TOKEN_EOP = "\uE002"  # End of Paragraph
 TOKEN_EOT = "\uE003"  # End of Story
 
+# Characters kept by remove_other_language_chars (inclusive code point ranges)
+KEEP_RANGES = [
+    (0x0600, 0x06FF),  # Arabic block (includes Urdu)
+    (0x0750, 0x077F),  # Arabic Supplement
+    (0x08A0, 0x08FF),  # Arabic Extended-A
+    (0xFB50, 0xFDFF),  # Arabic Presentation Forms-A
+    (0xFE70, 0xFEFF),  # Arabic Presentation Forms-B
+    (0xE000, 0xE003),  # Our special tokens
+]
+KEEP_CHARS = " \t\n\r" + "۔،؛؟!\"'()[]{}"  # Whitespace and common punctuation used in Urdu
+NUMBER_CATEGORIES = ("Nd", "Nl", "No")  # Digits/numbers from any script are kept too
+
+# Regexes compiled once at import instead of on every call
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+URL_RE = re.compile(r"https?://[^\s]+")
+AD_RE = re.compile(r"(?:advertisement|ads?|click here|subscribe)", re.IGNORECASE)
+MULTISPACE_RE = re.compile(r"[ \t]+")
+MULTINEWLINE_RE = re.compile(r"\n{3,}")
+SPACE_BEFORE_PUNCT_RE = re.compile(r" +([۔،؛؟!])")
+MISSING_SPACE_AFTER_PUNCT_RE = re.compile(r"([۔؟!])([^\s\uE001\uE002\uE003])")
+# One sentence per match; Urdu sentence endings: ۔ (U+06D4), ؟ (U+061F), plus ! and .
+SENTENCE_RE = re.compile(r"[^۔؟!.]*[۔؟!.]\s*|[^۔؟!.]+")
+LEADING_NUMBER_RE = re.compile(r"^(\d+)")
+
+
+def build_keep_table() -> np.ndarray:
+    """Boolean lookup table over all Unicode code points: True = keep (ranges and chars above)."""
+    table = np.zeros(0x110000, dtype=bool)
+    for lo, hi in KEEP_RANGES:
+        table[lo:hi + 1] = True
+    for char in KEEP_CHARS:
+        table[ord(char)] = True
+    return table
+
+
+KEEP_TABLE = build_keep_table()
+
+
+@functools.lru_cache(maxsize=None)
+def is_number_code_point(cp: int) -> bool:
+    """True if the code point is a number (Unicode category Nd/Nl/No); cached across stories."""
+    return unicodedata.category(chr(cp)) in NUMBER_CATEGORIES
+
 
 def remove_html_and_ads(text: str) -> str:
     """Remove any remaining HTML tags, URLs, and ad-like content."""
     # Remove HTML tags
-    text = re.sub(r"<[^>]+>", "", text)
+    text = HTML_TAG_RE.sub("", text)
     # Remove URLs
-    text = re.sub(r"https?://[^\s]+", "", text)
+    text = URL_RE.sub("", text)
     # Remove common ad patterns
-    text = re.sub(r"(?:advertisement|ads?|click here|subscribe)", "", text, flags=re.IGNORECASE)
+    text = AD_RE.sub("", text)
     return text
 
 
@@ -37,36 +84,19 @@ def remove_other_language_chars(text: str) -> str:
     """
     Keep only Urdu/Arabic script, numbers, and essential punctuation.
     Remove Latin, Devanagari, and other script characters.
+    Works on the whole text at once as a NumPy array of code points.
     """
-    result = []
-    for char in text:
-        cat = unicodedata.category(char)
-        cp = ord(char)
-        # Keep: Arabic (0600-06FF), Arabic Supplement (0750-077F), Arabic Extended-A (08A0-08FF)
-        # Keep: Arabic Presentation Forms (FB50-FDFF, FE70-FEFF)
-        # Keep: Our special tokens (E000-E003)
-        # Keep: digits, spaces, Zs (space separators)
-        # Keep: common punctuation used in Urdu
-        if 0x0600 <= cp <= 0x06FF:  # Arabic block (includes Urdu)
-            result.append(char)
-        elif 0x0750 <= cp <= 0x077F:  # Arabic Supplement
-            result.append(char)
-        elif 0x08A0 <= cp <= 0x08FF:  # Arabic Extended-A
-            result.append(char)
-        elif 0xFB50 <= cp <= 0xFDFF or 0xFE70 <= cp <= 0xFEFF:  # Arabic Presentation
-            result.append(char)
-        elif 0xE000 <= cp <= 0xE003:  # Our special tokens
-            result.append(char)
-        elif cat == "Nd" or cat == "Nl" or cat == "No":  # Numbers
-            result.append(char)
-        elif char in " \t\n\r":
-            result.append(char)
-        elif char in "۔،؛؟!\"'()[]{}":
-            result.append(char)
-        elif cp in (0x06D4, 0x061F, 0x060C, 0x061B):  # Urdu punctuation
-            result.append(char)
-        # Skip Latin, Devanagari, etc.
-    return "".join(result)
+    cps = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    keep = KEEP_TABLE[cps]
+
+    # Numbers: check the Unicode category once per distinct code point not already kept
+    candidates = np.unique(cps[~keep]).tolist()
+    numbers = [cp for cp in candidates if is_number_code_point(cp)]
+    if numbers:
+        keep |= np.isin(cps, numbers)
+
+    # Skip Latin, Devanagari, etc.
+    return cps[keep].tobytes().decode("utf-32-le")
 
 
 def normalize_unicode(text: str) -> str:
@@ -77,13 +107,13 @@ def normalize_unicode(text: str) -> str:
 def standardize_punctuation(text: str) -> str:
     """Standardize punctuation - normalize spaces around punctuation."""
     # Normalize multiple spaces to single space
-    text = re.sub(r"[ \t]+", " ", text)
+    text = MULTISPACE_RE.sub(" ", text)
     # Normalize multiple newlines to double newline (paragraph break)
-    text = re.sub(r"\n{3,}", "\n\n", text)
+    text = MULTINEWLINE_RE.sub("\n\n", text)
     # Remove spaces before punctuation
-    text = re.sub(r" +([۔،؛؟!])", r"\1", text)
+    text = SPACE_BEFORE_PUNCT_RE.sub(r"\1", text)
     # Ensure space after sentence-ending punctuation
-    text = re.sub(r"([۔؟!])([^\s\uE001\uE002\uE003])", r"\1 \2", text)
+    text = MISSING_SPACE_AFTER_PUNCT_RE.sub(r"\1 \2", text)
     return text.strip()
 
 
@@ -94,8 +124,6 @@ def add_special_tokens(content: str) -> str:
     - EOP after each paragraph
     - EOT will be added between stories
     """
-    # Urdu sentence endings: ۔ (U+06D4), ؟ (U+061F), plus ! and .
-    sentence_endings = "۔؟!."
     paragraphs = content.split("\n\n")
     tokenized_paragraphs = []
 
@@ -103,21 +131,12 @@ def add_special_tokens(content: str) -> str:
         para = para.strip()
         if not para:
             continue
-        # Split into sentences (by ۔ ؟ ! .)
-        sentences = re.split(r"([۔؟!.])\s*", para)
-        # Rejoin: split creates ["text", "end", "text", "end", ...]
+        # Each match is one sentence: text up to and including its ending (or trailing text with none)
         tokenized_sentences = []
-        i = 0
-        while i < len(sentences):
-            if i + 1 < len(sentences) and sentences[i + 1] in sentence_endings:
-                sent = (sentences[i] + sentences[i + 1]).strip()
-                if sent:
-                    tokenized_sentences.append(sent + TOKEN_EOS)
-                i += 2
-            else:
-                if sentences[i].strip():
-                    tokenized_sentences.append(sentences[i].strip() + TOKEN_EOS)
-                i += 1
+        for m in SENTENCE_RE.finditer(para):
+            sent = m.group(0).strip()
+            if sent:
+                tokenized_sentences.append(sent + TOKEN_EOS)
 
         if tokenized_sentences:
             # Join sentences with EOP, add EOP at end of paragraph
@@ -153,6 +172,23 @@ def preprocess_text(text: str) -> str:
     return text
 
 
+def process_story_file(filepath: Path) -> tuple:
+    """
+    Extract and preprocess one story file (runs in a worker process).
+    Returns (preprocessed text or None, status message for the log).
+    """
+    try:
+        content = extract_story_content(str(filepath))
+        if not content or len(content) < 20:
+            return None, f"Skip (empty/short): {filepath.name}"
+        preprocessed = preprocess_text(content)
+        if preprocessed:
+            return preprocessed, f"OK: {filepath.name}"
+        return None, f"Skip (no content after preprocessing): {filepath.name}"
+    except Exception as e:
+        return None, f"Error {filepath.name}: {e}"
+
+
 def main():
     print("Urdu Stories Preprocessing")
     print("=" * 50)
@@ -164,7 +200,7 @@ def main():
 
     # Get all txt files, sorted by number for consistent order
     def sort_key(p):
-        m = re.match(r"^(\d+)", p.stem)
+        m = LEADING_NUMBER_RE.match(p.stem)
         return (int(m.group(1)) if m else 999, p.name)
 
     txt_files = sorted(data_path.glob("*.txt"), key=sort_key)
@@ -175,21 +211,15 @@ def main():
 
     print(f"Found {len(txt_files)} story files.")
 
+    # Stories are independent, so they are preprocessed in parallel (one process per core);
+    # map() keeps the original file order
     all_stories = []
-    for i, filepath in enumerate(txt_files, 1):
-        try:
-            content = extract_story_content(str(filepath))
-            if not content or len(content) < 20:
-                print(f"  [{i}] Skip (empty/short): {filepath.name}")
-                continue
-            preprocessed = preprocess_text(content)
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(process_story_file, txt_files, chunksize=8)
+        for i, (preprocessed, status) in enumerate(results, 1):
+            print(f"  [{i}] {status}")
             if preprocessed:
                 all_stories.append(preprocessed)
-                print(f"  [{i}] OK: {filepath.name}")
-            else:
-                print(f"  [{i}] Skip (no content after preprocessing): {filepath.name}")
-        except Exception as e:
-            print(f"  [{i}] Error {filepath.name}: {e}")
 
     # Join all stories with EOT token
     combined = (TOKEN_EOT + "\n\n").join(all_stories)
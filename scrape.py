@@ -5,128 +5,142 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer, NavigableString, Tag
+from bs4.element import PreformattedString
+import aiohttp
+import asyncio
 import time
 import os
 import re
-import requests
 
 # Data folder
 data_folder = "data"
 os.makedirs(data_folder, exist_ok=True)
 
+# Story pages are fetched concurrently, at most this many at a time
+MAX_CONCURRENT_REQUESTS = 8
+# Polite delay each fetch slot waits before taking the next story
+REQUEST_DELAY_S = 2
+REQUEST_TIMEOUT_S = 15
+
+# Regexes compiled once instead of on every paragraph
+WHITESPACE_RE = re.compile(r'\s+')
+INVALID_FILENAME_CHARS_RE = re.compile(r'[<>:"/\\|?*]')
+
+# Only the tags parse_story_page looks at (title, author, content block) are built into the tree;
+# matching tags keep their full subtree, so everything inside the content div is still there
+STORY_PAGE_TAGS = SoupStrainer(['h1', 'a', 'span', 'div', 'p', 'br'])
+
+# Tags whose start and end break the text into separate paragraphs
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'blockquote', 'li', 'ul', 'ol', 'table', 'tr',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'hr'}
+MIN_PARAGRAPH_CHARS = 15  # Skip very short paragraphs (labels, stray punctuation)
+
 def clean_filename(title):
     """Clean the title to make it a valid filename"""
-    title = re.sub(r'[<>:"/\\|?*]', '', title)
+    title = INVALID_FILENAME_CHARS_RE.sub('', title)
     title = title.strip().replace(' ', '_') 
     return title[:100] if len(title) > 100 else title
 
-def scrape_story_content(story_url):
-    """Scrape the content of a single story"""
+async def scrape_story_content(session, story_url):
+    """Fetch a single story page and scrape its content"""
     try:
-        response = requests.get(story_url, timeout=15)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+        async with session.get(story_url, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_S)) as response:
+            response.raise_for_status()
+            html = await response.read()
+        return parse_story_page(html)
+    except Exception as e:
+        print(f"Error scraping story: {e}")
+        return None
+
+def iter_paragraphs(content_div):
+    """
+    Yield the paragraphs of content_div in document order, in a single walk
+    without modifying the tree. Text is buffered and flushed as a paragraph at
+    every <br> and at the start and end of every block-level tag.
+    """
+    buffer = []
+    
+    def flush():
+        text = WHITESPACE_RE.sub(' ', ' '.join(buffer)).strip()
+        buffer.clear()
+        return text
+    
+    def walk(node):
+        for child in node.children:
+            if isinstance(child, Tag):
+                if child.name == 'br':
+                    yield flush()
+                elif child.name in BLOCK_TAGS:
+                    yield flush()
+                    yield from walk(child)
+                    yield flush()
+                else:
+                    yield from walk(child)
+            # Comments, CDATA, doctypes etc. are not visible text
+            elif isinstance(child, NavigableString) and not isinstance(child, PreformattedString):
+                buffer.append(child)
+    
+    for text in walk(content_div):
+        if len(text) > MIN_PARAGRAPH_CHARS:
+            yield text
+    text = flush()
+    if len(text) > MIN_PARAGRAPH_CHARS:
+        yield text
+
+def parse_story_page(html):
+    """Extract title, author and content from a story page (None if no content block is found)"""
+    soup = BeautifulSoup(html, 'lxml', parse_only=STORY_PAGE_TAGS)
+    
+    # Find the story title
+    title_elem = soup.find('h1', class_='poemTitle') or soup.find('h1')
+    title = title_elem.get_text(strip=True) if title_elem else "Untitled"
+    
+    # Find author
+    author_elem = soup.find('a', class_='poetName') or soup.find('span', class_='author')
+    author = author_elem.get_text(strip=True) if author_elem else "Unknown"
+    
+    # Find the story content
+    content_div = soup.find('div', class_='poemPageContentBody')
+    if not content_div:
+        content_div = soup.find('div', class_='contentBody')
+    if not content_div:
+        content_div = soup.find('div', id='content')
+    
+    if content_div:
+        # Remove unwanted elements (scripts, styles, ads, navigation, etc.)
+        for element in content_div.find_all(['script', 'style', 'noscript', 'iframe', 
+                                               'nav', 'header', 'footer', 'aside']):
+            element.decompose()
         
-        # Find the story title
-        title_elem = soup.find('h1', class_='poemTitle') or soup.find('h1')
-        title = title_elem.get_text(strip=True) if title_elem else "Untitled"
+        # Remove elements with common ad/navigation classes
+        for class_pattern in ['ad', 'advertisement', 'nav', 'menu', 'sidebar', 
+                               'social', 'share', 'comment', 'related']:
+            for element in content_div.find_all(class_=lambda x: x and class_pattern in x.lower()):
+                element.decompose()
         
-        # Find author
-        author_elem = soup.find('a', class_='poetName') or soup.find('span', class_='author')
-        author = author_elem.get_text(strip=True) if author_elem else "Unknown"
+        # Strategy: Extract visible text while preserving paragraph structure
+        # (one pass over the tree; <br> and block-level tags end a paragraph)
+        paragraphs = list(iter_paragraphs(content_div))
         
-        # Find the story content
-        content_div = soup.find('div', class_='poemPageContentBody')
-        if not content_div:
-            content_div = soup.find('div', class_='contentBody')
-        if not content_div:
-            content_div = soup.find('div', id='content')
+        # Remove duplicate consecutive paragraphs
+        unique_paragraphs = []
+        prev_para = None
+        for para in paragraphs:
+            if para != prev_para:
+                unique_paragraphs.append(para)
+                prev_para = para
         
-        if content_div:
-            # Remove unwanted elements (scripts, styles, ads, navigation, etc.)
-            for element in content_div.find_all(['script', 'style', 'noscript', 'iframe', 
-                                                   'nav', 'header', 'footer', 'aside']):
-                element.decompose()
-            
-            # Remove elements with common ad/navigation classes
-            for class_pattern in ['ad', 'advertisement', 'nav', 'menu', 'sidebar', 
-                                   'social', 'share', 'comment', 'related']:
-                for element in content_div.find_all(class_=lambda x: x and class_pattern in x.lower()):
-                    element.decompose()
-            
-            # Strategy: Extract visible text while preserving paragraph structure
-            paragraphs = []
-            
-            # Method 1: Try to find paragraph tags first
-            p_tags = content_div.find_all('p')
-            if p_tags:
-                for p in p_tags:
-                    text = p.get_text(separator=' ', strip=True)
-                    # Clean up extra whitespace
-                    text = re.sub(r'\s+', ' ', text).strip()
-                    if text and len(text) > 15:  # Skip very short paragraphs
-                        paragraphs.append(text)
-            
-            # Method 2: If no <p> tags, look for <br> tag separated content
-            if not paragraphs:
-                # Replace <br> tags with a special marker
-                for br in content_div.find_all('br'):
-                    br.replace_with('\n||PARA_BREAK||\n')
-                
-                # Get text and split by marker
-                full_text = content_div.get_text(separator=' ')
-                potential_paragraphs = full_text.split('||PARA_BREAK||')
-                
-                for para in potential_paragraphs:
-                    para = para.strip()
-                    if para and len(para) > 15:
-                        # Clean up whitespace
-                        para = re.sub(r'\s+', ' ', para).strip()
-                        paragraphs.append(para)
-            
-            # Method 3: If still no paragraphs, look for div blocks
-            if not paragraphs:
-                div_blocks = content_div.find_all('div', recursive=True)
-                for div in div_blocks:
-                    # Only get direct text, not from nested divs
-                    text = ''.join([str(content) for content in div.contents 
-                                   if isinstance(content, str)])
-                    text = re.sub(r'\s+', ' ', text).strip()
-                    if text and len(text) > 15:
-                        paragraphs.append(text)
-            
-            # Method 4: Last resort - split by double newlines
-            if not paragraphs:
-                full_text = content_div.get_text(separator=' ')
-                potential_paragraphs = [p.strip() for p in re.split(r'\n\s*\n', full_text)]
-                
-                for para in potential_paragraphs:
-                    if para and len(para) > 15:
-                        para = re.sub(r'\s+', ' ', para).strip()
-                        paragraphs.append(para)
-            
-            # Remove duplicate consecutive paragraphs
-            unique_paragraphs = []
-            prev_para = None
-            for para in paragraphs:
-                if para != prev_para:
-                    unique_paragraphs.append(para)
-                    prev_para = para
-            
-            # Join paragraphs with exactly one blank line between them
-            if unique_paragraphs:
-                story_text = '\n\n'.join(unique_paragraphs)
-            else:
-                # Absolute last resort: get all text as single block
-                story_text = content_div.get_text(separator=' ', strip=True)
-                story_text = re.sub(r'\s+', ' ', story_text).strip()
-            
-            return {'title': title, 'author': author, 'content': story_text}
-        return None
-    except Exception as e:
-        print(f"Error scraping story: {e}")
-        return None
+        # Join paragraphs with exactly one blank line between them
+        if unique_paragraphs:
+            story_text = '\n\n'.join(unique_paragraphs)
+        else:
+            # Absolute last resort: get all text as single block
+            story_text = content_div.get_text(separator=' ', strip=True)
+            story_text = WHITESPACE_RE.sub(' ', story_text).strip()
+        
+        return {'title': title, 'author': author, 'content': story_text}
+    return None
 
 def get_all_story_urls():
     """Use Selenium to load all stories and extract URLs"""
@@ -200,6 +214,44 @@ def get_all_story_urls():
     finally:
         driver.quit()
 
+def save_story(story_count, story_url, story_data):
+    """Write one scraped story to the data folder"""
+    filename = clean_filename(story_data['title'])
+    filepath = os.path.join(data_folder, f"{story_count:03d}_{filename}.txt")
+    
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(f"Title: {story_data['title']}\n")
+        f.write(f"Author: {story_data['author']}\n")
+        f.write(f"URL: {story_url}\n")
+        f.write("=" * 60 + "\n\n")
+        f.write(story_data['content'])
+
+async def scrape_one(session, semaphore, story_count, total, story_url):
+    """Scrape and save one story, holding one of the MAX_CONCURRENT_REQUESTS slots"""
+    async with semaphore:
+        print(f"\n[{story_count}/{total}] Scraping: {story_url}")
+        
+        # Get story content
+        story_data = await scrape_story_content(session, story_url)
+        
+        if story_data:
+            save_story(story_count, story_url, story_data)
+            print(f"✓ Saved: {story_data['title'][:50]}")
+        else:
+            print(f"✗ Failed to get content")
+        
+        # Delay before this slot is released to the next request
+        await asyncio.sleep(REQUEST_DELAY_S)
+
+async def scrape_stories(story_urls):
+    """Scrape all stories over one aiohttp session, MAX_CONCURRENT_REQUESTS at a time"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[
+            scrape_one(session, semaphore, story_count, len(story_urls), story_url)
+            for story_count, story_url in enumerate(story_urls, 1)
+        ])
+
 def main():
     """Main function to scrape all stories"""
     print("Starting to scrape Urdu children's stories...")
@@ -218,36 +270,11 @@ def main():
     print(f"Starting to scrape {len(story_urls)} stories...")
     print(f"{'='*60}\n")
     
-    # Step 2: Scrape each story
-    story_count = 0
-    for story_url in story_urls:
-        story_count += 1
-        print(f"\n[{story_count}/{len(story_urls)}] Scraping: {story_url}")
-        
-        # Get story content
-        story_data = scrape_story_content(story_url)
-        
-        if story_data:
-            # Save to file
-            filename = clean_filename(story_data['title'])
-            filepath = os.path.join(data_folder, f"{story_count:03d}_{filename}.txt")
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(f"Title: {story_data['title']}\n")
-                f.write(f"Author: {story_data['author']}\n")
-                f.write(f"URL: {story_url}\n")
-                f.write("=" * 60 + "\n\n")
-                f.write(story_data['content'])
-            
-            print(f"✓ Saved: {story_data['title'][:50]}")
-        else:
-            print(f"✗ Failed to get content")
-        
-        # Delay between requests
-        time.sleep(2)
+    # Step 2: Scrape the stories concurrently
+    asyncio.run(scrape_stories(story_urls))
     
     print("\n" + "=" * 60)
-    print(f"Scraping complete! Total stories saved: {story_count}")
+    print(f"Scraping complete! Total stories saved: {len(story_urls)}")
 
 if __name__ == "__main__":
     main()
@@ -4,9 +4,10 @@ Trains a Byte Pair Encoding tokenizer on Urdu stories for efficient subword toke
 Vocabulary size: 250
 """
 
+import heapq
 import json
 import re
-from collections import defaultdict
+from collections import Counter, defaultdict
 from pathlib import Path
 
 # Special tokens (must match preprocess.py)
@@ -20,6 +21,21 @@ INPUT_FILE = "urdu_stories_preprocessed.txt"
 OUTPUT_VOCAB = "bpe_vocab.json"
 OUTPUT_MERGES = "bpe_merges.txt"
 
+# tokenize() remembers each distinct word's merged tokens across calls (for the
+# same merge_rules list), and tokenize_ids() its token ids (for the same vocab too);
+# each cache is cleared when it reaches this many words
+WORD_CACHE_SIZE = 100_000
+_word_cache = {"merge_rules": None, "merge_ranks": None, "words": {}, "vocab": None, "word_ids": {}}
+
+SPECIAL_TOKENS = frozenset({TOKEN_EOS, TOKEN_EOP, TOKEN_EOT})
+
+# Pre-tokenization: runs of whitespace separate words and each special token is
+# captured as its own piece (the uncaptured group yields None in re.split)
+SPLIT_RE = re.compile(f"([{TOKEN_EOS}{TOKEN_EOP}{TOKEN_EOT}])|[ \n\t\r]+")
+
+# decode_ids() keeps the id -> token list of the last vocab dict it was given
+_id_to_token_cache = {"vocab": None, "tokens": []}
+
 
 def get_pairs(word: list) -> set:
     """Get all adjacent pairs in a word (list of tokens)."""
@@ -39,22 +55,155 @@ def count_pairs(words: list) -> dict:
     return pair_counts
 
 
+def merge_word(word: list, pair: tuple, new_token: str) -> list:
+    """Merge all occurrences of pair in one word (left to right), return the new word."""
+    first, second = pair
+    i = 0
+    new_word = []
+    while i < len(word):
+        if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
+            new_word.append(new_token)
+            i += 2
+        else:
+            new_word.append(word[i])
+            i += 1
+    return new_word
+
+
 def merge_pair(words: list, pair: tuple, new_token: str) -> list:
     """Merge all occurrences of pair in words, return updated word list."""
-    first, second = pair
-    new_words = []
-    for word in words:
-        i = 0
-        new_word = []
-        while i < len(word):
-            if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
-                new_word.append(new_token)
-                i += 2
-            else:
-                new_word.append(word[i])
-                i += 1
-        new_words.append(new_word)
-    return new_words
+    return [merge_word(word, pair, new_token) for word in words]
+
+
+def index_pairs(words: list, freqs: list) -> tuple:
+    """
+    Count pairs across distinct words weighted by word frequency (a pair counts
+    once per word occurrence, as in count_pairs) and index which words contain
+    each pair. Returns (pair_counts, where) with where[pair] = set of word indices.
+    """
+    pair_counts = defaultdict(int)
+    where = defaultdict(set)
+    for i, (word, freq) in enumerate(zip(words, freqs)):
+        for pair in get_pairs(word):
+            pair_counts[pair] += freq
+            where[pair].add(i)
+    return pair_counts, where
+
+
+def merge_pair_indexed(words: list, freqs: list, pair: tuple, new_token: str,
+                       pair_counts: dict, where: dict, heap: list):
+    """
+    Merge pair in place in only the words that contain it, updating pair_counts
+    and where by the difference between each word's pairs before and after.
+    Every pair whose count changed gets a fresh (-count, pair) entry on heap.
+    """
+    changed = set()
+    for i in list(where.get(pair, ())):
+        old_pairs = get_pairs(words[i])
+        words[i] = merge_word(words[i], pair, new_token)
+        new_pairs = get_pairs(words[i])
+        freq = freqs[i]
+
+        for p in old_pairs - new_pairs:
+            pair_counts[p] -= freq
+            where[p].discard(i)
+            if not where[p]:
+                del pair_counts[p]
+                del where[p]
+        for p in new_pairs - old_pairs:
+            pair_counts[p] += freq
+            where[p].add(i)
+        changed |= old_pairs ^ new_pairs
+
+    for p in changed:
+        if p in pair_counts:
+            heapq.heappush(heap, (-pair_counts[p], p))
+
+
+def pop_most_frequent(heap: list, pair_counts: dict, tie_key) -> tuple:
+    """
+    Pop the most frequent pair from a lazy max-heap of (-count, pair) entries.
+    Entries whose count no longer matches pair_counts are stale and skipped.
+    Among pairs tied on the top count, the one with the smallest tie_key(pair)
+    wins; the others are pushed back. Returns (pair, count), or (None, 0).
+    """
+    while heap:
+        neg_count, pair = heapq.heappop(heap)
+        if pair_counts.get(pair) == -neg_count:
+            break
+    else:
+        return None, 0
+
+    tied = {pair}
+    while heap and heap[0][0] == neg_count:
+        _, other = heapq.heappop(heap)
+        if pair_counts.get(other) == -neg_count:
+            tied.add(other)
+    best_pair = min(tied, key=tie_key)
+    for other in tied - {best_pair}:
+        heapq.heappush(heap, (neg_count, other))
+    return best_pair, -neg_count
+
+
+def build_merge_ranks(merge_rules: list) -> dict:
+    """Map each merge pair to its priority (lower rank = learned earlier = merged first)."""
+    return {pair: rank for rank, pair in enumerate(merge_rules)}
+
+
+def apply_merges(word: list, merge_ranks: dict) -> list:
+    """
+    Apply BPE merges to a single word using a min-heap of (rank, position).
+    Repeatedly merges the lowest-rank adjacent pair (leftmost first on ties),
+    which gives the same result as applying every merge rule in order.
+    """
+    symbols = list(word)
+    n = len(symbols)
+    if n < 2:
+        return symbols
+
+    # Doubly linked list over positions; merged-away positions become None
+    prev_pos = list(range(-1, n - 1))
+    next_pos = list(range(1, n + 1))
+    next_pos[-1] = -1
+
+    heap = []
+    for i in range(n - 1):
+        rank = merge_ranks.get((symbols[i], symbols[i + 1]))
+        if rank is not None:
+            heap.append((rank, i))
+    heapq.heapify(heap)
+
+    while heap:
+        rank, i = heapq.heappop(heap)
+        j = next_pos[i]
+        # Skip stale entries (either side already merged into something else)
+        if symbols[i] is None or j == -1 or merge_ranks.get((symbols[i], symbols[j])) != rank:
+            continue
+
+        symbols[i] = symbols[i] + symbols[j]
+        symbols[j] = None
+        next_pos[i] = next_pos[j]
+        if next_pos[j] != -1:
+            prev_pos[next_pos[j]] = i
+
+        # Queue the new pairs formed with the left and right neighbours
+        left = prev_pos[i]
+        if left != -1:
+            left_rank = merge_ranks.get((symbols[left], symbols[i]))
+            if left_rank is not None:
+                heapq.heappush(heap, (left_rank, left))
+        right = next_pos[i]
+        if right != -1:
+            right_rank = merge_ranks.get((symbols[i], symbols[right]))
+            if right_rank is not None:
+                heapq.heappush(heap, (right_rank, i))
+
+    return [s for s in symbols if s is not None]
+
+
+def _pretokenize(text: str) -> list:
+    """Split text into words (runs of whitespace separate them); each special token is its own word."""
+    return [piece for piece in SPLIT_RE.split(text) if piece]
 
 
 def train_bpe(corpus: str, vocab_size: int = VOCAB_SIZE) -> tuple:
@@ -62,33 +211,8 @@ def train_bpe(corpus: str, vocab_size: int = VOCAB_SIZE) -> tuple:
     Train BPE tokenizer from scratch.
     Returns: (vocabulary dict, list of merge rules)
     """
-    # Pre-tokenize: split by whitespace, treat special tokens as separate units
-    # Split text into "words" - sequences separated by space/newline
-    # Each character (including special tokens) becomes initial token
-    special_tokens = {TOKEN_EOS, TOKEN_EOP, TOKEN_EOT}
-
-    def tokenize_to_chars(text: str) -> list:
-        """Split text into list of words, each word as list of characters."""
-        # Split by whitespace but preserve structure
-        tokens = []
-        current_word = []
-        for char in text:
-            if char in special_tokens:
-                if current_word:
-                    tokens.append(current_word)
-                    current_word = []
-                tokens.append([char])  # Special token as single-char "word"
-            elif char in " \n\t\r":
-                if current_word:
-                    tokens.append(current_word)
-                    current_word = []
-            else:
-                current_word.append(char)
-        if current_word:
-            tokens.append(current_word)
-        return tokens
-
-    words = tokenize_to_chars(corpus)
+    # Pre-tokenize into "words" - each character (including special tokens) becomes initial token
+    words = _pretokenize(corpus)
 
     # Build initial vocabulary from unique characters
     vocab = set()
@@ -97,7 +221,7 @@ def train_bpe(corpus: str, vocab_size: int = VOCAB_SIZE) -> tuple:
             vocab.add(char)
 
     # Ensure special tokens and space are in vocab (space needed for decode)
-    vocab.update(special_tokens)
+    vocab.update(SPECIAL_TOKENS)
     vocab.add(" ")
 
     # Convert to sorted list for consistent ordering (special tokens first)
@@ -107,15 +231,27 @@ def train_bpe(corpus: str, vocab_size: int = VOCAB_SIZE) -> tuple:
 
     merge_rules = []
 
+    # Identical words always merge identically: train on distinct words weighted by frequency.
+    # Pair counts are built once and then only updated for the words each merge touches.
+    word_freqs = Counter(words)
+    words = [list(word) for word in word_freqs]
+    freqs = list(word_freqs.values())
+    pair_counts, where = index_pairs(words, freqs)
+    heap = [(-count, pair) for pair, count in pair_counts.items()]
+    heapq.heapify(heap)
+
+    def first_occurrence(pair: tuple) -> tuple:
+        """(word index, position) of the first occurrence of pair; words are in corpus order."""
+        i = min(where[pair])
+        word = words[i]
+        return i, next(j for j in range(len(word) - 1) if (word[j], word[j + 1]) == pair)
+
     # BPE training: merge until we reach vocab_size
     while len(vocab) < vocab_size:
-        pair_counts = count_pairs(words)
-        if not pair_counts:
+        # Get most frequent pair; ties go to the pair found first in corpus order
+        best_pair, best_count = pop_most_frequent(heap, pair_counts, first_occurrence)
+        if best_pair is None:
             break
-
-        # Get most frequent pair
-        best_pair = max(pair_counts, key=pair_counts.get)
-        best_count = pair_counts[best_pair]
         if best_count < 2:  # No point merging pairs that appear once
             break
 
@@ -126,8 +262,8 @@ def train_bpe(corpus: str, vocab_size: int = VOCAB_SIZE) -> tuple:
         vocab[new_token] = len(vocab)
         merge_rules.append((best_pair[0], best_pair[1]))
 
-        # Apply merge
-        words = merge_pair(words, best_pair, new_token)
+        # Apply merge (only to words containing the pair)
+        merge_pair_indexed(words, freqs, best_pair, new_token, pair_counts, where, heap)
 
         if len(vocab) >= vocab_size:
             break
@@ -135,38 +271,15 @@ def train_bpe(corpus: str, vocab_size: int = VOCAB_SIZE) -> tuple:
     return vocab, merge_rules
 
 
-def tokenize(text: str, vocab: dict, merge_rules: list) -> list:
+def tokenize(text: str, vocab: dict, merge_rules: list, merge_ranks: dict = None) -> list:
     """
     Tokenize text using trained BPE.
     Returns list of token strings.
+    Merged words are cached per merge_rules list, so the merge rules must not be
+    modified in place after the first call (load or train a new list instead).
     """
-    special_tokens = {TOKEN_EOS, TOKEN_EOP, TOKEN_EOT}
-
-    def tokenize_to_chars(text: str) -> list:
-        tokens = []
-        current_word = []
-        for char in text:
-            if char in special_tokens:
-                if current_word:
-                    tokens.append(current_word)
-                    current_word = []
-                tokens.append([char])
-            elif char in " \n\t\r":
-                if current_word:
-                    tokens.append(current_word)
-                    current_word = []
-            else:
-                current_word.append(char)
-        if current_word:
-            tokens.append(current_word)
-        return tokens
-
-    words = tokenize_to_chars(text)
-
-    # Apply merge rules in order
-    for first, second in merge_rules:
-        new_token = first + second
-        words = merge_pair(words, (first, second), new_token)
+    merge_word_cached = _word_merger(merge_rules, merge_ranks)
+    words = [merge_word_cached(word) for word in _pretokenize(text)]
 
     # Flatten to token list, insert space between words for correct decoding
     result = []
@@ -176,11 +289,65 @@ def tokenize(text: str, vocab: dict, merge_rules: list) -> list:
         if i < len(words) - 1:
             next_word = words[i + 1]
             # Add space if next is not a special token (words are separated by space in original)
-            if not (len(next_word) == 1 and next_word[0] in special_tokens):
+            if not (len(next_word) == 1 and next_word[0] in SPECIAL_TOKENS):
                 result.append(" ")
     return result
 
 
+def tokenize_ids(text: str, vocab: dict, merge_rules: list, merge_ranks: dict = None) -> list:
+    """
+    Tokenize text straight to token IDs, without building the token list:
+    same as [vocab[t] for t in tokenize(text, vocab, merge_rules)].
+    Each distinct word's ids are cached next to its merged tokens (per vocab
+    dict, which must not be modified in place after the first call either).
+    """
+    merge_word_cached = _word_merger(merge_rules, merge_ranks)
+    if _word_cache["vocab"] is not vocab:
+        _word_cache["vocab"] = vocab
+        _word_cache["word_ids"] = {}
+    word_ids = _word_cache["word_ids"]
+
+    ids = []
+    for i, word in enumerate(_pretokenize(text)):
+        # Words are separated by a space, except before a special token
+        if i and word not in SPECIAL_TOKENS:
+            ids.append(vocab[" "])
+        cached = word_ids.get(word)
+        if cached is None:
+            if len(word_ids) >= WORD_CACHE_SIZE:
+                word_ids.clear()
+            cached = word_ids[word] = tuple(vocab[t] for t in merge_word_cached(word))
+        ids.extend(cached)
+    return ids
+
+
+def _word_merger(merge_rules: list, merge_ranks: dict = None):
+    """
+    Return a function word -> tuple of merged tokens backed by the module-level
+    word cache, which is reset whenever a different merge_rules list is passed.
+    """
+    if _word_cache["merge_rules"] is not merge_rules:
+        _word_cache["merge_rules"] = merge_rules
+        _word_cache["merge_ranks"] = merge_ranks if merge_ranks is not None else build_merge_ranks(merge_rules)
+        _word_cache["words"] = {}
+        _word_cache["word_ids"] = {}
+    if merge_ranks is None:
+        merge_ranks = _word_cache["merge_ranks"]
+    merged = _word_cache["words"]
+
+    # Apply merge rules per word, lowest rank first.
+    # Words repeat heavily, so each distinct word is merged once and then served from the cache.
+    def merge_word_cached(word: str) -> tuple:
+        tokens = merged.get(word)
+        if tokens is None:
+            if len(merged) >= WORD_CACHE_SIZE:
+                merged.clear()
+            tokens = merged[word] = tuple(apply_merges(list(word), merge_ranks))
+        return tokens
+
+    return merge_word_cached
+
+
 def decode(tokens: list) -> str:
     """Decode token list back to string."""
     return "".join(tokens)
@@ -188,15 +355,24 @@ def decode(tokens: list) -> str:
 
 def encode_ids(text: str, vocab: dict, merge_rules: list) -> list:
     """Tokenize text and return list of token IDs (for use in language models)."""
-    tokens = tokenize(text, vocab, merge_rules)
-    return [vocab[t] for t in tokens]
+    return tokenize_ids(text, vocab, merge_rules)
 
 
 def decode_ids(ids: list, vocab: dict) -> str:
-    """Decode list of token IDs back to string."""
-    id_to_token = {v: k for k, v in vocab.items()}
-    tokens = [id_to_token.get(i, "") for i in ids]
-    return "".join(tokens)
+    """
+    Decode list of token IDs back to string (unknown ids decode to "").
+    The id -> token list is built once per vocab dict, which must not be
+    modified in place after the first call.
+    """
+    if _id_to_token_cache["vocab"] is not vocab:
+        id_to_token = [""] * (max(vocab.values(), default=-1) + 1)
+        for token, i in vocab.items():
+            id_to_token[i] = token
+        _id_to_token_cache["vocab"] = vocab
+        _id_to_token_cache["tokens"] = id_to_token
+    id_to_token = _id_to_token_cache["tokens"]
+    n_ids = len(id_to_token)
+    return "".join(id_to_token[i] if 0 <= i < n_ids else "" for i in ids)
 
 
 def save_tokenizer(vocab: dict, merge_rules: list, vocab_path: str, merges_path: str):
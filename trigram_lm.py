@@ -5,19 +5,34 @@ Phase III: Trigram Language Model
 - Supports variable-length generation until <EOT> token is reached
 """
 
+import functools
 import json
 import pickle
 import random
+import warnings
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional: the sampling kernel is plain NumPy and runs as-is without it
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
 # Import tokenizer (from Phase II)
 from train_bpe_tokenizer import (
     TOKEN_EOS,
     TOKEN_EOP,
     TOKEN_EOT,
+    SPECIAL_TOKENS,
     load_tokenizer,
     tokenize,
+    tokenize_ids,
     decode,
 )
 
@@ -27,7 +42,10 @@ INPUT_FILE = "urdu_stories_preprocessed.txt"
 VOCAB_FILE = "bpe_vocab.json"
 MERGES_FILE = "bpe_merges.txt"
 MODEL_FILE = "trigram_lm.pkl"  # Using pickle for faster loading
-TOKENS_CACHE = "corpus_tokens_cache.json"
+TOKENS_CACHE = "corpus_tokens_cache.npy"  # Tokenized corpus as int32 token ids
+LEGACY_TOKENS_CACHE = "corpus_tokens_cache.json"  # Older cache of token strings, converted on first use
+MODEL_BIN_DIR = "trigram_lm_bin"  # Compiled tables as raw binary files, memory-mapped at load
+BIN_FORMAT_VERSION = 5  # Bump whenever compile_model's table layout changes
 
 # Interpolation weights: P(w3|w1,w2) = λ1*P(w3) + λ2*P(w3|w2) + λ3*P(w3|w1,w2)
 # Higher weight on higher-order n-grams (trigram most informative)
@@ -35,43 +53,107 @@ LAMBDA_UNI = 0.1
 LAMBDA_BI = 0.3
 LAMBDA_TRI = 0.6
 
+# Add-k smoothing constant used for every n-gram order
+SMOOTHING_K = 0.01
+
+# generate() caches the sampling CDF of recently used (context, temperature) pairs
+CDF_CACHE_SIZE = 4096  # ~2 KB per entry for V=250
+# The most frequent contexts (BOS, BOS first) get their sampling CDFs built together,
+# once per temperature, for the WARM_TEMPERATURES most recently used temperatures
+WARM_CONTEXTS = 64
+WARM_TEMPERATURES = 16
+
+# Stories handed to each tokenizer worker process at a time
+TOKENIZE_CHUNKSIZE = 64
+
 # Set to limit corpus size for faster testing (None = use full corpus)
 CORPUS_CHAR_LIMIT = None  # Set to e.g. 80000 for quicker testing; None = full corpus
 
 
-def build_ngram_counts(tokens: list) -> tuple:
+def build_ngram_counts(ids: np.ndarray, bos_id: int, eot_id: int) -> tuple:
     """
-    Build unigram, bigram, and trigram counts from token sequence.
-    Prepends BOS tokens for proper context at sequence start.
+    Build unigram, bigram, and trigram counts from a token id sequence.
+    Prepends BOS ids for proper context at sequence start.
     """
-    unigram = defaultdict(int)
-    bigram = defaultdict(int)
-    trigram = defaultdict(int)
+    if not len(ids):
+        return {}, {}, {}
+
+    # Split after each EOT to get individual stories, add BOS at start of each
+    starts = np.concatenate(([0], np.flatnonzero(ids[:-1] == eot_id) + 1))
+    padded = np.insert(ids.astype(np.int64), np.repeat(starts, 2), bos_id)
+    first_bos = starts + 2 * np.arange(len(starts))
+
+    # N-grams never end on a story's padding, except its (BOS, BOS) bigram
+    bi_valid = np.ones(len(padded), dtype=bool)
+    bi_valid[first_bos] = False
+    tri_valid = bi_valid.copy()
+    tri_valid[first_bos + 1] = False
+
+    # Pack every window into one int64 key and count them with np.unique
+    base = bos_id + 1
+    bi_keys = padded[:-1] * base + padded[1:]
+    tri_keys = bi_keys[:-1] * base + padded[2:]
+    unigram = _count_packed(padded, 1, base)
+    bigram = _count_packed(bi_keys[bi_valid[1:]], 2, base)
+    trigram = _count_packed(tri_keys[tri_valid[2:]], 3, base)
+    return unigram, bigram, trigram
 
-    # Split by EOT to get individual stories, add BOS at start of each
-    stories = []
-    current = []
-    for t in tokens:
-        current.append(t)
-        if t == TOKEN_EOT:
-            stories.append([TOKEN_BOS, TOKEN_BOS] + current)
-            current = []
 
-    if current:
-        stories.append([TOKEN_BOS, TOKEN_BOS] + current)
+def _count_packed(keys: np.ndarray, n: int, base: int) -> dict:
+    """
+    Count packed n-gram keys. Returns {id: count} for n == 1, else
+    {id tuple: count}, in first-occurrence order.
+    """
+    uniq, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    order = np.argsort(first)
+    uniq, counts = uniq[order], counts[order].tolist()
+    if n == 1:
+        return dict(zip(uniq.tolist(), counts))
 
-    for story in stories:
-        for i, t in enumerate(story):
-            unigram[t] += 1
-            if i >= 1:
-                bigram[(story[i - 1], t)] += 1
-            if i >= 2:
-                trigram[(story[i - 2], story[i - 1], t)] += 1
+    digits = []
+    for _ in range(n):
+        uniq, digit = np.divmod(uniq, base)
+        digits.append(digit.tolist())
+    return dict(zip(zip(*reversed(digits)), counts))
+
+
+# Tokenizer state of a tokenize_corpus worker process, set once by its initializer
+_worker_tokenizer = {}
+
+
+def _init_tokenize_worker(vocab: dict, merge_rules: list):
+    _worker_tokenizer["vocab"] = vocab
+    _worker_tokenizer["merge_rules"] = merge_rules
+
+
+def _tokenize_story(text: str) -> list:
+    return tokenize_ids(text, _worker_tokenizer["vocab"], _worker_tokenizer["merge_rules"])
 
-    return unigram, bigram, trigram
 
+def tokenize_corpus(corpus: str, vocab: dict, merge_rules: list) -> np.ndarray:
+    """
+    Tokenize the corpus story by story across worker processes, straight to
+    an int32 array of token ids. BPE never merges across an EOT, so this
+    returns the ids of tokenize(corpus, vocab, merge_rules).
+    """
+    stories = corpus.split(TOKEN_EOT)
+    stories = [story + TOKEN_EOT for story in stories[:-1]] + [stories[-1]]
+
+    # vocab and merge_rules reach each worker once, not once per story
+    with ProcessPoolExecutor(initializer=_init_tokenize_worker, initargs=(vocab, merge_rules)) as executor:
+        results = executor.map(_tokenize_story, stories, chunksize=TOKENIZE_CHUNKSIZE)
+
+        special_ids = {vocab[t] for t in SPECIAL_TOKENS}
+        ids = []
+        for story_ids in results:
+            # tokenize() puts a space between an EOT and a following word
+            if ids and story_ids and story_ids[0] not in special_ids:
+                ids.append(vocab[" "])
+            ids.extend(story_ids)
+    return np.asarray(ids, dtype=np.int32)
 
-def mle_probability(count: int, total: int, vocab_size: int, k: float = 0.01) -> float:
+
+def mle_probability(count: int, total: int, vocab_size: int, k: float = SMOOTHING_K) -> float:
     """
     MLE with add-k (Laplace) smoothing for unseen n-grams.
     P = (count + k) / (total + k * vocab_size)
@@ -81,17 +163,19 @@ def mle_probability(count: int, total: int, vocab_size: int, k: float = 0.01) ->
     return (count + k) / (total + k * vocab_size)
 
 
-def train_trigram_lm(corpus_tokens: list, vocab: dict) -> dict:
+def train_trigram_lm(corpus_ids: np.ndarray, vocab: dict) -> dict:
     """
     Train trigram LM using MLE.
+    corpus_ids holds token ids (vocab[token]); BOS gets id len(vocab).
     Returns model dict with counts and vocab_size for interpolation.
     """
-    unigram, bigram, trigram = build_ngram_counts(corpus_tokens)
+    # Vocab list: all tokens from tokenizer, indexed by id (for decoding)
+    vocab_list = list(vocab.keys())
     vocab_size = len(vocab)
-    total_unigrams = sum(unigram.values())
+    bos_id = len(vocab_list)
 
-    # Vocab list: all tokens from tokenizer (for generation)
-    vocab_list = list(vocab.keys())
+    unigram, bigram, trigram = build_ngram_counts(corpus_ids, bos_id, vocab.get(TOKEN_EOT, -1))
+    total_unigrams = sum(unigram.values())
 
     # Precompute bigram context totals: for each w2, sum of count(w2, x)
     bigram_context_totals = defaultdict(int)
@@ -103,23 +187,235 @@ def train_trigram_lm(corpus_tokens: list, vocab: dict) -> dict:
     for (w1, w2, w3), c in trigram.items():
         trigram_context_totals[(w1, w2)] += c
 
+    # N-gram keys are ids / id tuples in memory and in the pickle (joined with tabs only for JSON)
     model = {
         "unigram": dict(unigram),
-        "bigram": dict((f"{k[0]}\t{k[1]}", v) for k, v in bigram.items()),
-        "trigram": dict((f"{k[0]}\t{k[1]}\t{k[2]}", v) for k, v in trigram.items()),
+        "bigram": dict(bigram),
+        "trigram": dict(trigram),
         "bigram_context_totals": dict(bigram_context_totals),
-        "trigram_context_totals": dict((f"{k[0]}\t{k[1]}", v) for k, v in trigram_context_totals.items()),
+        "trigram_context_totals": dict(trigram_context_totals),
         "total_unigrams": total_unigrams,
         "vocab_size": vocab_size,
         "vocab_list": vocab_list,
+        "bos_id": bos_id,
     }
     return model
 
 
-def get_interpolated_prob(model: dict, w1: str, w2: str, w3: str) -> float:
+# Array tables produced by compile_model, in the argument order expected by interpolated_weights
+_TABLE_KEYS = (
+    "uni_probs",
+    "bi_offsets", "bi_next", "bi_probs_q", "bi_scale", "bi_base",
+    "tri_rows", "tri_offsets", "tri_next", "tri_probs_q", "tri_scale", "tri_base",
+)
+
+# Count dicts that compile_model replaces with arrays, with the number of ids in their keys
+_COUNT_KEYS = {
+    "unigram": 1,
+    "bigram": 2,
+    "trigram": 3,
+    "bigram_context_totals": 1,
+    "trigram_context_totals": 2,
+}
+
+# Count dicts keyed by tuples (stored as tab-joined strings in legacy JSON backups)
+_TUPLE_KEYED = ("bigram", "trigram", "trigram_context_totals")
+
+# Row probabilities are stored as uint16 fixed point: prob ~= q * row_scale
+QUANT_MAX = np.iinfo(np.uint16).max
+
+
+def _build_csr(rows: list, next_ids: list, values: list, n_rows: int) -> tuple:
+    """Group (row, next_id, value) triples into CSR arrays: offsets[n_rows + 1], next ids, values."""
+    rows = np.asarray(rows, dtype=np.int64)
+    order = np.argsort(rows, kind="stable")
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=offsets[1:])
+    next_arr = np.asarray(next_ids, dtype=np.int32)[order]
+    value_arr = np.asarray(values, dtype=np.float64)[order]
+    return offsets, next_arr, value_arr
+
+
+def _quantize_rows(offsets: np.ndarray, values: np.ndarray) -> tuple:
+    """
+    Quantize CSR row values to uint16 relative to each row's maximum.
+    Returns (q, scale) with values ~= q * scale[row]; empty rows get scale 0.
+    The scale is float32 (4 bytes per row on top of 2 per entry); the kernels
+    widen it to float64 before multiplying.
+    """
+    n_rows = len(offsets) - 1
+    row_of = np.repeat(np.arange(n_rows), np.diff(offsets))
+    row_max = np.zeros(n_rows, dtype=np.float64)
+    np.maximum.at(row_max, row_of, values)
+    scale = (row_max / QUANT_MAX).astype(np.float32)
+    q = np.zeros(len(values), dtype=np.uint16)
+    if len(values):
+        q[:] = np.minimum(np.rint(values / scale[row_of].astype(np.float64)), QUANT_MAX)
+    return q, scale
+
+
+def pack_context(t1: int, t2: int, n_ctx: int) -> int:
+    """Pack context ids (t1, t2) into a single int key; t2 == ctx % n_ctx."""
+    return t1 * n_ctx + t2
+
+
+def compile_model(model: dict) -> dict:
+    """
+    Convert the n-gram count dicts into Structure-of-Arrays tables for sampling.
+
+    Token ids are positions in vocab_list, as in the count dicts. Context ids
+    additionally use len(vocab_list) for BOS (the model's bos_id) and
+    len(vocab_list) + 1 for tokens outside the vocabulary (no counts, so they
+    back off to the unigram distribution).
+
+    A trigram context (t1, t2) is packed into one int, ctx = t1 * n_ctx + t2
+    (see pack_context), which indexes the flat tri_rows table directly.
+
+    Each bigram/trigram context becomes a CSR row of (next id, uint16 prob)
+    holding the count part of the smoothed probability (dequantized with a
+    per-row scale), plus a per-row base k / (total + k*V) shared by every
+    token (0 marks an unseen context).
+    The returned dict holds only the arrays and vocab metadata - the count
+    dicts are dropped, so it is meant for serving, not for saving.
+    """
+    vocab_list = model["vocab_list"]
+    n_vocab = len(vocab_list)
+    bos_id = n_vocab
+    unk_id = n_vocab + 1
+    n_ctx = n_vocab + 2
+
+    token_ids = {t: i for i, t in enumerate(vocab_list)}
+
+    V = model["vocab_size"]
+    k = SMOOTHING_K
+
+    # Unigram P(w3) is context-independent: precompute it once
+    uni = model["unigram"]
+    uni_counts = np.array([uni.get(i, 0) for i in range(n_vocab)], dtype=np.float64)
+    uni_probs = (uni_counts + k) / (model["total_unigrams"] + k * V)
+
+    # Bigram rows indexed by context id of w2
+    bi_denoms = np.zeros(n_ctx, dtype=np.float64)
+    for w2, total in model.get("bigram_context_totals", {}).items():
+        bi_denoms[w2] = total + k * V
+    bi_rows, bi_next, bi_probs = [], [], []
+    for (w2, w3), c in model["bigram"].items():
+        if w3 < n_vocab:
+            bi_rows.append(w2)
+            bi_next.append(w3)
+            bi_probs.append(c / bi_denoms[w2])
+    bi_offsets, bi_next, bi_probs = _build_csr(bi_rows, bi_next, bi_probs, n_ctx)
+    bi_probs_q, bi_scale = _quantize_rows(bi_offsets, bi_probs)
+    bi_base = np.divide(k, bi_denoms, out=np.zeros(n_ctx), where=bi_denoms > 0)
+
+    # Trigram rows: one per seen (w1, w2) context, located through a flat index over packed contexts
+    tri_rows = np.full(n_ctx * n_ctx, -1, dtype=np.int32)
+    tri_denoms = []
+    for (w1, w2), total in model.get("trigram_context_totals", {}).items():
+        tri_rows[pack_context(w1, w2, n_ctx)] = len(tri_denoms)
+        tri_denoms.append(total + k * V)
+    tri_denoms = np.asarray(tri_denoms, dtype=np.float64)
+
+    t_rows, t_next, t_probs = [], [], []
+    for (w1, w2, w3), c in model["trigram"].items():
+        if w3 < n_vocab:
+            row = tri_rows[pack_context(w1, w2, n_ctx)]
+            t_rows.append(row)
+            t_next.append(w3)
+            t_probs.append(c / tri_denoms[row])
+    tri_offsets, tri_next, tri_probs = _build_csr(t_rows, t_next, t_probs, len(tri_denoms))
+    tri_probs_q, tri_scale = _quantize_rows(tri_offsets, tri_probs)
+    tri_base = k / tri_denoms
+
+    compiled = {key: value for key, value in model.items() if key not in _COUNT_KEYS and key != "_compiled"}
+    compiled.update(
+        num_unigrams=len(uni),
+        num_bigrams=len(model["bigram"]),
+        num_trigrams=len(model["trigram"]),
+        token_ids=token_ids,
+        bos_id=bos_id,
+        unk_id=unk_id,
+        n_ctx=n_ctx,
+        uni_probs=uni_probs,
+        bi_offsets=bi_offsets,
+        bi_next=bi_next,
+        bi_probs_q=bi_probs_q,
+        bi_scale=bi_scale,
+        bi_base=bi_base,
+        tri_rows=tri_rows,
+        tri_offsets=tri_offsets,
+        tri_next=tri_next,
+        tri_probs_q=tri_probs_q,
+        tri_scale=tri_scale,
+        tri_base=tri_base,
+    )
+    return compiled
+
+
+def compiled_form(model: dict) -> dict:
+    """
+    Return the compiled form of model: the model itself if it is already
+    compiled, else compile_model(model), computed once and kept under
+    model["_compiled"] (recompile by deleting that key after changing the counts).
+    """
+    if "tri_rows" in model:
+        return model
+    compiled = model.get("_compiled")
+    if compiled is None:
+        compiled = model["_compiled"] = compile_model(model)
+    return compiled
+
+
+@njit(cache=True)
+def interpolated_weights(
+    ctx,
+    uni_probs,
+    bi_offsets, bi_next, bi_probs_q, bi_scale, bi_base,
+    tri_rows, tri_offsets, tri_next, tri_probs_q, tri_scale, tri_base,
+):
+    """
+    Interpolated next-token probabilities over the vocabulary for the packed
+    context ctx (see pack_context), built from the compiled arrays; same maths
+    as get_interpolated_prob, vectorized over the vocabulary.
+    """
+    V = uni_probs.shape[0]
+    t2 = ctx % bi_base.shape[0]
+
+    # Bigram P(w3|w2), falling back to unigram for unseen contexts
+    base = bi_base[t2]
+    if base > 0:
+        p_bi = np.full(V, base)
+        start, end = bi_offsets[t2], bi_offsets[t2 + 1]
+        p_bi[bi_next[start:end]] += bi_probs_q[start:end] * np.float64(bi_scale[t2])
+    else:
+        p_bi = uni_probs.copy()
+
+    # Trigram P(w3|w1,w2), falling back to bigram for unseen contexts
+    row = tri_rows[ctx]
+    if row >= 0:
+        p_tri = np.full(V, tri_base[row])
+        start, end = tri_offsets[row], tri_offsets[row + 1]
+        p_tri[tri_next[start:end]] += tri_probs_q[start:end] * np.float64(tri_scale[row])
+    else:
+        p_tri = p_bi
+
+    return LAMBDA_UNI * uni_probs + LAMBDA_BI * p_bi + LAMBDA_TRI * p_tri
+
+
+@njit(cache=True)
+def apply_temperature(weights, temperature):
+    """
+    Temperature-scale weights in log space: exp(log(w) / T - max), i.e.
+    w ** (1 / T) up to a constant factor, kept in range by the max shift.
+    """
+    logw = np.log(weights) / temperature
+    return np.exp(logw - logw.max())
+
+
+def get_interpolated_prob(model: dict, w1: int, w2: int, w3: int) -> float:
     """
     P(w3|w1,w2) = λ1*P(w3) + λ2*P(w3|w2) + λ3*P(w3|w1,w2)
-    With add-k smoothing for unseen n-grams.
+    With add-k smoothing for unseen n-grams. Takes token ids (BOS is model["bos_id"]).
     """
     V = model["vocab_size"]
     uni = model["unigram"]
@@ -134,43 +430,34 @@ def get_interpolated_prob(model: dict, w1: str, w2: str, w3: str) -> float:
     p_uni = mle_probability(c_uni, total_uni, V)
 
     # Bigram P(w3|w2)
-    bi_key = f"{w2}\t{w3}"
-    c_bi = bi.get(bi_key, 0)
+    c_bi = bi.get((w2, w3), 0)
     total_bi = bi_totals.get(w2, 0)
     p_bi = mle_probability(c_bi, total_bi, V) if total_bi > 0 else p_uni
 
     # Trigram P(w3|w1,w2)
-    tri_key = f"{w1}\t{w2}\t{w3}"
-    c_tri = tri.get(tri_key, 0)
-    tri_ctx = f"{w1}\t{w2}"
-    total_tri = tri_totals.get(tri_ctx, 0)
+    c_tri = tri.get((w1, w2, w3), 0)
+    total_tri = tri_totals.get((w1, w2), 0)
     p_tri = mle_probability(c_tri, total_tri, V) if total_tri > 0 else p_bi
 
     return LAMBDA_UNI * p_uni + LAMBDA_BI * p_bi + LAMBDA_TRI * p_tri
 
 
-def get_next_token_probs(model: dict, w1: str, w2: str) -> dict:
+def get_next_token_probs(model: dict, w1: str, w2: str) -> np.ndarray:
     """
     Get probability distribution over next token given context (w1, w2).
-    Returns dict of token -> probability.
+    Returns an array of probabilities aligned with model["vocab_list"],
+    computed from the compiled arrays (see compiled_form).
     """
-    vocab_list = model["vocab_list"]
-    probs = {}
-    for w in vocab_list:
-        probs[w] = get_interpolated_prob(model, w1, w2, w)
-    total = sum(probs.values())
-    if total > 0:
-        probs = {k: v / total for k, v in probs.items()}
+    model = compiled_form(model)
+    _, ctx = _start_sequence(model, [w1, w2])
+    probs = interpolated_weights(ctx, *(model[key] for key in _TABLE_KEYS))
+    # The weights do not sum to 1: counts of n-grams ending in BOS (the (BOS, BOS)
+    # bigram) and quantization leave mass outside the vocabulary. The samplers
+    # draw against cdf[-1] and skip this; only the returned distribution is normalized.
+    probs /= probs.sum()
     return probs
 
 
-def sample_from_probs(probs: dict) -> str:
-    """Sample one token from probability distribution."""
-    tokens = list(probs.keys())
-    weights = [probs[t] for t in tokens]
-    return random.choices(tokens, weights=weights, k=1)[0]
-
-
 def generate(
     model: dict,
     seed_tokens: list = None,
@@ -189,65 +476,275 @@ def generate(
         temperature: Sampling temperature (>1 more random, <1 more deterministic)
         random_seed: For reproducibility
     """
-    if random_seed is not None:
-        random.seed(random_seed)
+    return list(generate_iter(model, seed_tokens, max_tokens, temperature, random_seed))
+
+
+def generate_iter(
+    model: dict,
+    seed_tokens: list = None,
+    max_tokens: int = 1000,
+    temperature: float = 1.0,
+    random_seed: int = None,
+):
+    """
+    Generator version of generate(): yields the starting tokens, then each
+    sampled token as soon as it is drawn (same arguments, same sequence).
+    """
+    model = compiled_form(model)
+    rng = random.Random(random_seed)
+
+    vocab_list = model["vocab_list"]
+    n_ctx = model["n_ctx"]
+    last_id = len(vocab_list) - 1
+    context_cdf = _context_cdf_cache(model)
+    generated, ctx = _start_sequence(model, seed_tokens)
+    yield from generated
+
+    for _ in range(max_tokens - len(generated)):
+        # Inverse-CDF draw (weights need not be normalized), with the context's CDF reused across steps and calls
+        cdf = context_cdf(ctx, temperature)
+        next_id = min(int(np.searchsorted(cdf, rng.random() * cdf[-1], side="right")), last_id)
+        next_token = vocab_list[next_id]
+        yield next_token
+
+        if next_token == TOKEN_EOT:
+            break
+
+        # Shift the context: (t1, t2) -> (t2, next_id)
+        ctx = pack_context(ctx % n_ctx, next_id, n_ctx)
+
+
+def _context_cdf_cache(model: dict):
+    """
+    Return the model's cached (ctx, temperature) -> sampling CDF function,
+    creating it on first use. Contexts repeat heavily across steps and
+    requests, so most draws skip rebuilding the interpolated distribution.
+    """
+    context_cdf = model.get("context_cdf")
+    if context_cdf is None:
+        tables = tuple(model[key] for key in _TABLE_KEYS)
+        warm_rows = {ctx: i for i, ctx in enumerate(_warm_contexts(model))}
+        warm_weights = np.array([interpolated_weights(ctx, *tables) for ctx in warm_rows])
+
+        @functools.lru_cache(maxsize=WARM_TEMPERATURES)
+        def warm_cdfs(temperature: float) -> np.ndarray:
+            # Same maths as cold_cdf, with one cumsum over every warm context
+            weights = warm_weights
+            if temperature != 1.0:
+                weights = np.array([apply_temperature(w, temperature) for w in warm_weights])
+            return np.cumsum(weights, axis=1)
+
+        @functools.lru_cache(maxsize=CDF_CACHE_SIZE)
+        def cold_cdf(ctx: int, temperature: float) -> np.ndarray:
+            weights = interpolated_weights(ctx, *tables)
+            if temperature != 1.0:
+                weights = apply_temperature(weights, temperature)
+            return np.cumsum(weights)
+
+        def context_cdf(ctx: int, temperature: float) -> np.ndarray:
+            row = warm_rows.get(ctx)
+            if row is not None:
+                return warm_cdfs(temperature)[row]
+            return cold_cdf(ctx, temperature)
+
+        model["context_cdf"] = context_cdf
+    return context_cdf
+
+
+def _warm_contexts(model: dict) -> list:
+    """
+    The (BOS, BOS) start context followed by the most frequent trigram contexts.
+    A row's base k / (total + k*V) shrinks as its count grows, so ranking rows
+    by tri_base recovers the count order from the compiled tables.
+    """
+    n_ctx = model["n_ctx"]
+    start_ctx = pack_context(model["bos_id"], model["bos_id"], n_ctx)
+    ctxs = np.flatnonzero(np.asarray(model["tri_rows"]) >= 0)
+    by_count = ctxs[np.argsort(model["tri_base"][model["tri_rows"][ctxs]], kind="stable")]
+    return [start_ctx] + [ctx for ctx in by_count.tolist() if ctx != start_ctx][:WARM_CONTEXTS - 1]
 
+
+def _start_sequence(model: dict, seed_tokens: list) -> tuple:
+    """Return (generated tokens so far, packed context id) for a compiled model."""
     if seed_tokens is None or len(seed_tokens) < 2:
-        w1, w2 = TOKEN_BOS, TOKEN_BOS
         generated = [TOKEN_BOS, TOKEN_BOS]
     else:
-        w1, w2 = seed_tokens[-2], seed_tokens[-1]
         generated = list(seed_tokens)
 
-    for _ in range(max_tokens - len(generated)):
-        probs = get_next_token_probs(model, w1, w2)
+    token_ids = model["token_ids"]
+    ctx = [
+        model["bos_id"] if t == TOKEN_BOS else token_ids.get(t, model["unk_id"])
+        for t in generated[-2:]
+    ]
+    return generated, pack_context(ctx[0], ctx[1], model["n_ctx"])
 
-        # Apply temperature
-        if temperature != 1.0:
-            probs = {k: v ** (1 / temperature) for k, v in probs.items()}
-            total = sum(probs.values())
-            probs = {k: v / total for k, v in probs.items()}
 
-        next_token = sample_from_probs(probs)
-        generated.append(next_token)
-
-        if next_token == TOKEN_EOT:
-            break
+def generate_batch(model: dict, jobs: list) -> list:
+    """
+    Run several generations, all drawing from the model's shared
+    per-context CDF cache (see generate_iter).
 
-        w1, w2 = w2, next_token
+    Args:
+        model: Trigram model (see compiled_form)
+        jobs: List of dicts with generate()'s keyword arguments
+              (seed_tokens, max_tokens, temperature, random_seed)
 
-    return generated
+    Returns one token list per job, identical to what generate() returns for
+    the same arguments.
+    """
+    model = compiled_form(model)
+    return [generate(model, **job) for job in jobs]
 
 
-def save_model(model: dict, path: str, also_json: bool = False):
+def save_model(model: dict, path: str, also_npz: bool = False, also_json: bool = None):
     """
     Save model to pickle (.pkl) file.
     Pickle is faster and more compact than JSON, and preserves Python objects.
+    also_json is a deprecated alias of also_npz (the backup is no longer JSON).
     """
+    if also_json is not None:
+        warnings.warn(
+            "save_model(also_json=...) is deprecated and now writes a .npz backup; use also_npz",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        also_npz = also_npz or also_json
+    # The cached compiled form (see compiled_form) is rebuilt on demand, never saved
+    model = {key: value for key, value in model.items() if key != "_compiled"}
+
     # Save as pickle (binary format)
     with open(path, "wb") as f:
         pickle.dump(model, f)
-    
-    # Optionally also save as JSON (human-readable backup)
-    if also_json:
-        json_path = path.replace(".pkl", ".json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(model, f, ensure_ascii=False, indent=2)
+
+    # Optionally also save a compressed NumPy backup: each count dict becomes
+    # parallel int arrays of ids (one column per n-gram position) and counts
+    if also_npz:
+        arrays = {
+            key: np.asarray(value)
+            for key, value in model.items()
+            if key not in _COUNT_KEYS
+        }
+        for name, order in _COUNT_KEYS.items():
+            table = model[name]
+            arrays[f"{name}_ids"] = np.array(list(table), dtype=np.int32).reshape(len(table), order)
+            arrays[f"{name}_counts"] = np.fromiter(table.values(), dtype=np.int64, count=len(table))
+        np.savez_compressed(path.replace(".pkl", ".npz"), **arrays)
 
 
 def load_model(path: str) -> dict:
     """
-    Load model from pickle (.pkl) or JSON (.json) file.
+    Load model from pickle (.pkl), NumPy (.npz) or legacy JSON (.json) file.
     Auto-detects format based on file extension.
     """
     path_obj = Path(path)
+    if path_obj.suffix == ".npz":
+        return _load_npz_model(path)
     if path_obj.suffix == ".pkl":
         with open(path, "rb") as f:
-            return pickle.load(f)
+            model = pickle.load(f)
     else:
         # Fallback to JSON
         with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            model = json.load(f)
+
+    # JSON backups (and pickles from older versions) use tab-joined string keys
+    for name in _TUPLE_KEYED:
+        table = model.get(name)
+        if table and isinstance(next(iter(table)), str):
+            model[name] = {tuple(key.split("\t")): v for key, v in table.items()}
+
+    if "bos_id" not in model:
+        return _upgrade_token_keys(model)
+    return model
+
+
+def _load_npz_model(path: str) -> dict:
+    """Rebuild the model dict from a backup written by save_model(also_npz=True)."""
+    model = {}
+    with np.load(path) as data:
+        for name, order in _COUNT_KEYS.items():
+            ids = data[f"{name}_ids"]
+            keys = ids[:, 0].tolist() if order == 1 else map(tuple, ids.tolist())
+            model[name] = dict(zip(keys, data[f"{name}_counts"].tolist()))
+        for key in data.files:
+            if not key.endswith(("_ids", "_counts")):
+                model[key] = data[key].tolist()
+    return model
+
+
+def _upgrade_token_keys(model: dict) -> dict:
+    """Re-key the count dicts of a model saved by older versions (keyed by token strings) by token ids."""
+    bos_id = len(model["vocab_list"])
+    token_ids = {t: i for i, t in enumerate(model["vocab_list"])}
+    token_ids[TOKEN_BOS] = bos_id
+
+    for name in _COUNT_KEYS:
+        model[name] = {
+            tuple(token_ids[t] for t in key) if isinstance(key, tuple) else token_ids[key]: v
+            for key, v in model[name].items()
+        }
+    model["bos_id"] = bos_id
+    return model
+
+
+def save_compiled_model(compiled: dict, out_dir: str):
+    """
+    Save a compiled model (see compile_model) as raw binary files for memory-mapping.
+
+    Every NumPy table becomes <name>.bin; the vocabulary becomes one UTF-8 blob
+    (vocab.bin) plus uint32 byte offsets (vocab_offsets.bin). meta.json records
+    dtype/shape for each table and the remaining scalar metadata.
+    """
+    out_path = Path(out_dir)
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    meta = {"format_version": BIN_FORMAT_VERSION, "arrays": {}, "scalars": {}}
+    for key, value in compiled.items():
+        if isinstance(value, np.ndarray):
+            np.ascontiguousarray(value).tofile(out_path / f"{key}.bin")
+            meta["arrays"][key] = {"dtype": value.dtype.str, "shape": list(value.shape)}
+        elif key not in ("vocab_list", "token_ids", "context_cdf"):
+            meta["scalars"][key] = value
+
+    encoded = [t.encode("utf-8") for t in compiled["vocab_list"]]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    (out_path / "vocab.bin").write_bytes(b"".join(encoded))
+    offsets.tofile(out_path / "vocab_offsets.bin")
+
+    with open(out_path / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_compiled_model(bin_dir: str) -> dict:
+    """
+    Load a model written by save_compiled_model. Tables are np.memmap views of
+    the .bin files, so loading costs a few small reads and the OS page cache
+    is shared across warm invocations.
+    """
+    bin_path = Path(bin_dir)
+    with open(bin_path / "meta.json", "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format_version") != BIN_FORMAT_VERSION:
+        raise ValueError(
+            f"'{bin_dir}' has format version {meta.get('format_version')}, expected "
+            f"{BIN_FORMAT_VERSION}. Re-run convert_model.py."
+        )
+
+    model = dict(meta["scalars"])
+    for key, spec in meta["arrays"].items():
+        shape = tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:  # mmap cannot map empty files
+            model[key] = np.zeros(shape, dtype=spec["dtype"])
+        else:
+            model[key] = np.asarray(np.memmap(bin_path / f"{key}.bin", dtype=spec["dtype"], mode="r", shape=shape))
+
+    blob = (bin_path / "vocab.bin").read_bytes()
+    offsets = np.fromfile(bin_path / "vocab_offsets.bin", dtype=np.uint32).tolist()
+    vocab_list = [blob[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+    model["vocab_list"] = vocab_list
+    model["token_ids"] = {t: i for i, t in enumerate(vocab_list)}
+    return model
 
 
 def main():
@@ -272,12 +769,20 @@ def main():
         print(f"Error: Corpus '{INPUT_FILE}' not found. Run preprocess.py first.")
         return
 
-    # Load or tokenize corpus (cache for faster reruns; delete cache if changing CORPUS_CHAR_LIMIT)
+    # Load or tokenize corpus (cache for faster reruns; delete cache if changing CORPUS_CHAR_LIMIT
+    # or the tokenizer). Tokens are counted as int ids: small ints hash far cheaper than Urdu subword strings
     cache_path = Path(TOKENS_CACHE)
+    legacy_cache_path = Path(LEGACY_TOKENS_CACHE)
     if cache_path.exists():
         print(f"Loading tokenized corpus from cache ({TOKENS_CACHE})...")
-        with open(cache_path, "r", encoding="utf-8") as f:
+        corpus_ids = np.load(cache_path, mmap_mode="r")
+    elif legacy_cache_path.exists():
+        print(f"Loading tokenized corpus from cache ({LEGACY_TOKENS_CACHE})...")
+        with open(legacy_cache_path, "r", encoding="utf-8") as f:
             corpus_tokens = json.load(f)
+        corpus_ids = np.asarray([vocab[t] for t in corpus_tokens], dtype=np.int32)
+        np.save(cache_path, corpus_ids)
+        print(f"  Converted cache to {TOKENS_CACHE}")
     else:
         print(f"Loading corpus from {INPUT_FILE}...")
         with open(input_path, "r", encoding="utf-8") as f:
@@ -286,23 +791,26 @@ def main():
             corpus = corpus[:CORPUS_CHAR_LIMIT]
             print(f"  (Using first {CORPUS_CHAR_LIMIT:,} chars)")
         print("Tokenizing corpus (this may take a few minutes)...")
-        corpus_tokens = tokenize(corpus, vocab, merge_rules)
-        with open(cache_path, "w", encoding="utf-8") as f:
-            json.dump(corpus_tokens, f, ensure_ascii=False)
+        corpus_ids = tokenize_corpus(corpus, vocab, merge_rules)
+        np.save(cache_path, corpus_ids)
         print(f"  Cached tokenized corpus to {TOKENS_CACHE}")
-    print(f"  Total tokens: {len(corpus_tokens):,}")
+    print(f"  Total tokens: {len(corpus_ids):,}")
 
     # Train trigram LM
     print("\nTraining trigram LM (MLE + interpolation)...")
-    model = train_trigram_lm(corpus_tokens, vocab)
+    model = train_trigram_lm(corpus_ids, vocab)
     print(f"  Unigram types: {len(model['unigram'])}")
     print(f"  Bigram types: {len(model['bigram'])}")
     print(f"  Trigram types: {len(model['trigram'])}")
 
-    # Save model (as .pkl, optionally also as .json)
-    save_model(model, MODEL_FILE, also_json=True)
+    # Save model (as .pkl, optionally also as .npz)
+    save_model(model, MODEL_FILE, also_npz=True)
     print(f"\nSaved model to {MODEL_FILE}")
-    print(f"  (Also saved JSON backup: {MODEL_FILE.replace('.pkl', '.json')})")
+    print(f"  (Also saved NumPy backup: {MODEL_FILE.replace('.pkl', '.npz')})")
+
+    runtime_model = compile_model(model)
+    save_compiled_model(runtime_model, MODEL_BIN_DIR)
+    print(f"  (Also saved memory-mapped tables: {MODEL_BIN_DIR}/)")
 
     # Generate samples
     print("\n" + "-" * 60)
@@ -310,7 +818,7 @@ def main():
     print("-" * 60)
 
     for i in range(3):
-        tokens = generate(model, max_tokens=500, temperature=0.9, random_seed=42 + i)
+        tokens = generate(runtime_model, max_tokens=500, temperature=0.9, random_seed=42 + i)
         # Filter BOS and decode
         text_tokens = [t for t in tokens if t != TOKEN_BOS]
         text = decode(text_tokens)